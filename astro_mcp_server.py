@@ -8,18 +8,34 @@ Prerequisites
 - A checked-out Astro project (git repo) and working `npm` install.
 - Set the environment variable `ASTRO_DIR` to the absolute path of your Astro
   project (defaults to `./astro`).
+- Optional: `pip install pygit2` and set `ASTRO_USE_PYGIT2=1` to stage and
+  commit in-process instead of spawning `git` for every publish. This bypasses
+  git hooks, commit signing and LFS filters, so the git CLI stays the default.
 
 """
 from __future__ import annotations
 
+import asyncio
+import datetime
+import hashlib
+import json
 import os
 import pathlib
-import subprocess
-from typing import List
+import re
+import shlex
+import sys
+import threading
+from dataclasses import dataclass
+from typing import Dict, List
 
 # MCP server helper from the `mcp-server` package (FastMCP implementation)
 from fastmcp import FastMCP
 
+try:  # optional: commit in-process instead of spawning git
+    import pygit2
+except ImportError:
+    pygit2 = None
+
 # ---------------------------------------------------------------------------
 # Configuration
 # ---------------------------------------------------------------------------
@@ -29,15 +45,193 @@ if not ASTRO_DIR.is_dir():
         f"ASTRO_DIR {ASTRO_DIR} does not exist or is not a directory"
     )
 
+# Article file extensions handled by the tools
+_MD_EXTS = ('.md', '.mdx')
+
+# The first "# " heading within the first 5 lines, used as the frontmatter
+# title; the lazy line skip makes the earliest heading win
+_TITLE_RE = re.compile(r'(?:[^\n]*\n){0,4}?# ([^\n]*)')
+_TITLE_SCAN_LIMIT = 2048
+
+# Local cache directory for state kept across server restarts
+_CACHE_DIR = pathlib.Path.home() / ".cache" / "astro_mcp"
+_PUBLISHED_FILE = _CACHE_DIR / "published.json"
+
+# Serializes tools that write to the checkout and run git/deploy in it
+_GIT_LOCK = asyncio.Lock()
+
+# Persistent libgit2 handle for ASTRO_DIR (opt-in via ASTRO_USE_PYGIT2),
+# or None to use the git CLI
+_REPO = None
+_REPO_LOCK = threading.Lock()
+if pygit2 is not None and os.getenv("ASTRO_USE_PYGIT2", "").lower() in ("1", "true", "yes"):
+    try:
+        _REPO = pygit2.Repository(str(ASTRO_DIR))
+    except pygit2.GitError:
+        pass
+
 # ---------------------------------------------------------------------------
 # Helper util
 # ---------------------------------------------------------------------------
 
-def _run(cmd: List[str]) -> str:
-    """Run *cmd* inside *ASTRO_DIR* and return the combined stdout+stderr."""
-    proc = subprocess.run(cmd, cwd=ASTRO_DIR, capture_output=True, text=True)
-    banner = f"$ {' '.join(cmd)}\n"
-    return banner + proc.stdout + proc.stderr
+@dataclass
+class CmdResult:
+    """Outcome of a command run inside *ASTRO_DIR*.
+    
+    stderr is merged into ``stdout`` by the OS; the banner + output string is
+    only built when the result is formatted.
+    """
+    cmd: str
+    stdout: str
+    returncode: int
+    
+    def __str__(self) -> str:
+        return f"$ {self.cmd}\n{self.stdout}"
+
+
+async def _exec(args: List[str], cmd: str) -> CmdResult:
+    """Spawn *args* inside *ASTRO_DIR* without blocking the event loop."""
+    proc = await asyncio.create_subprocess_exec(
+        *args,
+        cwd=ASTRO_DIR,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.STDOUT,
+    )
+    stdout, _ = await proc.communicate()
+    return CmdResult(cmd, stdout.decode(errors="replace"), proc.returncode)
+
+
+async def _arun(cmd: List[str]) -> CmdResult:
+    """Run *cmd* inside *ASTRO_DIR* and return its combined stdout+stderr."""
+    return await _exec(cmd, ' '.join(cmd))
+
+
+async def _run_script(script: str) -> CmdResult:
+    """Run a shell *script* inside *ASTRO_DIR* with a single ``bash -c`` spawn.
+
+    Chaining several commands with ``&&`` costs one fork+exec instead of one
+    per command, which dominates latency for small git operations.
+    """
+    return await _exec(["bash", "-c", script], script)
+
+
+def _pygit2_commit_all(message: str) -> CmdResult:
+    """Stage everything (like ``git add -A``) and commit it through *_REPO*.
+    
+    Blocking; meant to run in a worker thread. libgit2 objects are not safe
+    to share between threads, so all use of *_REPO* goes through *_REPO_LOCK*.
+    """
+    cmd = f"pygit2: add -A && commit -m {shlex.quote(message)}"
+    with _REPO_LOCK:
+        try:
+            index = _REPO.index
+            index.read()
+            index.add_all()
+            index.write()
+            tree = index.write_tree()
+            
+            if _REPO.head_is_unborn:
+                parents = []
+            else:
+                parents = [_REPO.head.target]
+                if _REPO.head.peel(pygit2.Commit).tree_id == tree:
+                    return CmdResult(cmd, "nothing to commit, working tree clean\n", 1)
+            
+            # Raises if user.name/user.email are not configured
+            signature = _REPO.default_signature
+            oid = _REPO.create_commit("HEAD", signature, signature, message, tree, parents)
+            return CmdResult(cmd, f"[{_REPO.head.shorthand} {str(oid)[:7]}] {message}\n", 0)
+        except (pygit2.GitError, KeyError) as e:
+            return CmdResult(cmd, f"error: {e}\n", 1)
+
+
+async def _commit_all(message: str) -> CmdResult:
+    """Stage and commit all changes in *ASTRO_DIR*.
+    
+    Uses the in-process pygit2 repository when enabled with
+    ``ASTRO_USE_PYGIT2``, which avoids spawning git; otherwise runs a single
+    ``git add && git commit``.
+    """
+    if _REPO is not None:
+        return await asyncio.to_thread(_pygit2_commit_all, message)
+    return await _run_script(f"git add -A && git commit -m {shlex.quote(message)}")
+
+
+def _load_published() -> Dict[pathlib.Path, dict]:
+    """Load the records of the last successful publish per path.
+    
+    Each record holds the content ``sha256``, whether the publish
+    ``deployed``, and the written file's ``mtime_ns`` and ``size``.
+    """
+    try:
+        data = json.loads(_PUBLISHED_FILE.read_text(encoding='utf-8'))
+    except (OSError, ValueError):
+        return {}
+    return {
+        pathlib.Path(path): record
+        for path, record in data.items()
+        if isinstance(record, dict)
+    }
+
+
+def _save_published() -> None:
+    """Persist *_LAST_PUBLISHED*; best-effort, a lost cache only costs a rebuild."""
+    try:
+        _CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        _PUBLISHED_FILE.write_text(
+            json.dumps({str(path): record for path, record in _LAST_PUBLISHED.items()}),
+            encoding='utf-8',
+        )
+    except OSError:
+        pass
+
+
+def _already_published(file_path: pathlib.Path, content_hash: str, deploy: bool) -> bool:
+    """Return True if *file_path* still holds the recorded publish of *content_hash*.
+    
+    A publish without deploy never satisfies one that asks for it, and the
+    file must be unchanged on disk since it was written (not edited by hand
+    or reverted by git).
+    """
+    record = _LAST_PUBLISHED.get(file_path)
+    if record is None or record.get("sha256") != content_hash:
+        return False
+    if deploy and not record.get("deployed"):
+        return False
+    try:
+        st = os.stat(file_path)
+    except OSError:
+        return False
+    return (st.st_mtime_ns, st.st_size) == (record.get("mtime_ns"), record.get("size"))
+
+
+def _record_published(file_path: pathlib.Path, content_hash: str, deployed: bool) -> None:
+    """Remember a successful publish of *file_path* along with its on-disk state."""
+    st = os.stat(file_path)
+    _LAST_PUBLISHED[file_path] = {
+        "sha256": content_hash,
+        "deployed": deployed,
+        "mtime_ns": st.st_mtime_ns,
+        "size": st.st_size,
+    }
+    _save_published()
+
+
+_LAST_PUBLISHED = _load_published()
+
+
+def _write_parts(path: pathlib.Path, parts: List[bytes]) -> None:
+    """Write *parts* to *path* with one scatter write, without joining them first."""
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        written = os.writev(fd, parts)
+        # writev may return short for large buffers; finish with plain writes
+        if written < sum(len(part) for part in parts):
+            rest = memoryview(b"".join(parts))[written:]
+            while rest:
+                rest = rest[os.write(fd, rest):]
+    finally:
+        os.close(fd)
 
 # ---------------------------------------------------------------------------
 # MCP app definition
@@ -50,7 +244,7 @@ app = FastMCP(
 # @app.tool()
 # async def publish_article() -> str:
 #     """Deploy the Astro blog to production by running npm run deploy."""
-#     return _run(["npm", "run", "deploy"])
+#     return str(await _arun(["npm", "run", "deploy"]))
 
 @app.tool()
 async def publish_blog_post(
@@ -69,24 +263,29 @@ async def publish_blog_post(
         commit_message: Optional custom commit message (defaults to "feat: publish {filename}")
         deploy: Whether to run npm deploy after commit (default: True)
     """
-    import datetime
-    outputs: List[str] = []
+    outputs: List[object] = []
     
     # Step 1: Save the article
     target_dir = ASTRO_DIR / directory
-    target_dir.mkdir(parents=True, exist_ok=True)
+    await asyncio.to_thread(target_dir.mkdir, parents=True, exist_ok=True)
     
     file_path = target_dir / filename
     
+    # Encode the body once; the same bytes are hashed and written. The hash
+    # covers the caller's content, since generated frontmatter embeds the
+    # current time and would never repeat
+    body = content.encode('utf-8')
+    content_hash = hashlib.sha256(body).hexdigest()
+    
     # Add frontmatter if the file is markdown and doesn't already have it
-    if filename.endswith(('.md', '.mdx')) and not content.startswith('---'):
+    frontmatter = ""
+    if filename.endswith(_MD_EXTS) and not content.startswith('---'):
         # Extract title from content (first # heading or filename)
-        title = filename.replace('.md', '').replace('.mdx', '').replace('-', ' ').title()
-        lines = content.split('\n')
-        for line in lines[:5]:  # Check first 5 lines for a title
-            if line.startswith('# '):
-                title = line[2:].strip()
-                break
+        title = filename.removesuffix('.md').removesuffix('.mdx').replace('-', ' ').title()
+        # Check the first 5 lines for a title, never scanning past 2 KiB
+        match = _TITLE_RE.match(content, 0, _TITLE_SCAN_LIMIT)
+        if match:
+            title = match.group(1).strip()
         
         frontmatter = f"""---
 title: "{title}"
@@ -96,37 +295,62 @@ author: "AI Assistant"
 ---
 
 """
-        content = frontmatter + content
-    
-    # Write the file
-    try:
-        file_path.write_text(content, encoding='utf-8')
-        outputs.append(f"✓ Saved article to: {file_path}")
-    except Exception as e:
-        return f"Error saving article: {str(e)}"
-    
-    # Step 2: Commit and push
-    outputs.append("\n=== Git Operations ===")
-    outputs.append(_run(["git", "add", "-A"]))
-    
-    # Use custom message or generate one
-    if not commit_message:
-        commit_message = f"feat: publish {filename}"
     
-    commit_result = _run(["git", "commit", "-m", commit_message])
-    outputs.append(commit_result)
-    
-    if "nothing to commit" not in commit_result:
-        outputs.append(_run(["git", "push"]))
-    else:
-        outputs.append("No changes to push.\n")
-    
-    # Step 3: Deploy (if requested)
-    if deploy:
-        outputs.append("\n=== Deployment ===")
-        outputs.append(_run(["npm", "run", "deploy"]))
-    
-    return "\n".join(outputs)
+    # One publish at a time: concurrent git add/commit/push in the same
+    # checkout fight over .git/index.lock and sweep up each other's files
+    async with _GIT_LOCK:
+        # Skip everything if this exact content was already published here
+        if await asyncio.to_thread(_already_published, file_path, content_hash, deploy):
+            return "✓ No changes (idempotent publish)"
+        
+        # Write the file; frontmatter and body go out in one writev, no concatenation
+        try:
+            await asyncio.to_thread(
+                _write_parts,
+                file_path,
+                [frontmatter.encode('utf-8'), body],
+            )
+            outputs.append(f"✓ Saved article to: {file_path}")
+        except Exception as e:
+            return f"Error saving article: {str(e)}"
+        
+        # Step 2: Commit and push
+        outputs.append("\n=== Git Operations ===")
+        
+        # Use custom message or generate one
+        if not commit_message:
+            commit_message = f"feat: publish {filename}"
+        
+        commit_result = await _commit_all(commit_message)
+        outputs.append(commit_result)
+        
+        # Step 3: push and deploy are independent, so run them concurrently
+        tasks = []
+        if "nothing to commit" not in commit_result.stdout:
+            tasks.append(_arun(["git", "push"]))
+        else:
+            outputs.append("No changes to push.\n")
+        if deploy:
+            tasks.append(_arun(["npm", "run", "deploy"]))
+        
+        results = await asyncio.gather(*tasks)
+        if deploy:
+            *push_results, deploy_result = results
+            outputs.extend(push_results)
+            outputs.append("\n=== Deployment ===")
+            outputs.append(deploy_result)
+        else:
+            outputs.extend(results)
+        
+        # Only remember the publish once every step went through, so a failed
+        # push or deploy is retried on the next call
+        committed = (
+            commit_result.returncode == 0 or "nothing to commit" in commit_result.stdout
+        )
+        if committed and all(r.returncode == 0 for r in results):
+            await asyncio.to_thread(_record_published, file_path, content_hash, deploy)
+    
+    return "\n".join(map(str, outputs))
 
 # @app.tool()
 # async def find_articles(
@@ -199,7 +423,7 @@ author: "AI Assistant"
 #         return f"File not found: {filepath}"
     
 #     # Check if it's a markdown file
-#     if not filepath.endswith(('.md', '.mdx')):
+#     if not filepath.endswith(_MD_EXTS):
 #         return f"Error: Can only delete markdown files (.md or .mdx), got: {filepath}"
     
 #     # Check if file is within ASTRO_DIR (security check)
@@ -208,36 +432,37 @@ author: "AI Assistant"
 #     except ValueError:
 #         return f"Error: File must be within ASTRO_DIR"
     
-#     outputs: List[str] = []
+#     outputs: List[object] = []
     
-#     # Delete the file
-#     try:
-#         file_path.unlink()
-#         outputs.append(f"✓ Deleted file: {filepath}")
-#     except Exception as e:
-#         return f"Error deleting file: {str(e)}"
-    
-#     # Commit and push if requested
-#     if commit:
-#         outputs.append("\n=== Git Operations ===")
-#         outputs.append(_run(["git", "add", "-A"]))
+#     # Serialized with publish_blog_post, see _GIT_LOCK
+#     async with _GIT_LOCK:
+#         # Delete the file
+#         try:
+#             await asyncio.to_thread(file_path.unlink)
+#             if _LAST_PUBLISHED.pop(file_path, None) is not None:
+#                 await asyncio.to_thread(_save_published)
+#             outputs.append(f"✓ Deleted file: {filepath}")
+#         except Exception as e:
+#             return f"Error deleting file: {str(e)}"
+        
+#         # Commit and push if requested
+#         if commit:
+#             outputs.append("\n=== Git Operations ===")
         
-#         commit_message = f"feat: remove article {file_path.name}"
-#         commit_result = _run(["git", "commit", "-m", commit_message])
-#         outputs.append(commit_result)
+#             commit_message = f"feat: remove article {file_path.name}"
+#             commit_result = await _commit_all(commit_message)
+#             outputs.append(commit_result)
         
-#         if push and "nothing to commit" not in commit_result:
-#             outputs.append(_run(["git", "push"]))
+#             if push and "nothing to commit" not in commit_result.stdout:
+#                 outputs.append(await _arun(["git", "push"]))
     
-#     return "\n".join(outputs)
+#     return "\n".join(map(str, outputs))
 
 # # ---------------------------------------------------------------------------
 # # Test mode support
 # # ---------------------------------------------------------------------------
 # async def test_mode():
 #     """Run in test mode - directly call tools for testing"""
-#     import json
-    
 #     print("=== MCP Server Test Mode ===")
 #     print(f"ASTRO_DIR: {ASTRO_DIR}")
 #     print("\nAvailable tools:")
@@ -308,11 +533,8 @@ author: "AI Assistant"
 # CLI entry-point
 # ---------------------------------------------------------------------------
 if __name__ == "__main__":
-    import sys
-    
     if len(sys.argv) > 1 and sys.argv[1] == "--test":
         # Run in test mode
-        import asyncio
         asyncio.run(test_mode())
     else:
         # Run as stdio server for MCP protocol